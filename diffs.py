@@ -0,0 +1,142 @@
+#
+# diffs.py
+# Parsing of the unified diffs produced by parse_kai_logs.py, so that large
+# diffs can be pruned down to the hunks near Konveyor incidents and split into
+# chunks that fit the judge's context window.
+#
+import math
+import re
+from dataclasses import dataclass, field
+from typing import List
+
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+# rough number of characters per token for code and English text
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class Hunk:
+    old_start: int
+    old_count: int
+    new_start: int
+    new_count: int
+    lines: List[str] = field(default_factory=list)
+
+    @property
+    def old_end(self) -> int:
+        return self.old_start + max(self.old_count, 1) - 1
+
+    def changed_lines(self) -> int:
+        return sum(1 for line in self.lines[1:] if line.startswith("+") or line.startswith("-"))
+
+
+@dataclass
+class FileDiff:
+    header: List[str] = field(default_factory=list)
+    hunks: List[Hunk] = field(default_factory=list)
+    omitted_hunks: int = 0
+
+    def changed_lines(self) -> int:
+        return sum(hunk.changed_lines() for hunk in self.hunks)
+
+    def render(self) -> str:
+        lines = list(self.header)
+        for hunk in self.hunks:
+            lines.extend(hunk.lines)
+        if self.omitted_hunks:
+            lines.append(f"# {self.omitted_hunks} hunk(s) not near any incident omitted")
+        return "\n".join(lines)
+
+
+def parse_diff(diff: str) -> FileDiff:
+    """
+    Splits a single file unified diff into its header and hunks.
+
+    """
+    file_diff = FileDiff()
+    for line in diff.splitlines():
+        match = HUNK_HEADER.match(line)
+        if match:
+            old_start, old_count, new_start, new_count = match.groups()
+            file_diff.hunks.append(Hunk(
+                old_start=int(old_start),
+                old_count=int(old_count) if old_count is not None else 1,
+                new_start=int(new_start),
+                new_count=int(new_count) if new_count is not None else 1,
+                lines=[line],
+            ))
+        elif file_diff.hunks:
+            file_diff.hunks[-1].lines.append(line)
+        else:
+            file_diff.header.append(line)
+    return file_diff
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def incident_lines(incidents: list) -> List[int]:
+    """
+    Returns the line numbers in the original file of the incidents that have one.
+
+    """
+    lines = []
+    for incident in incidents:
+        line_number = incident.get("lineNumber")
+        if line_number is not None:
+            lines.append(int(line_number))
+    return sorted(lines)
+
+
+def prune_diff(file_diff: FileDiff, lines: List[int], context: int) -> FileDiff:
+    """
+    Returns a FileDiff containing only the hunks that touch the original file
+    within context lines of one of the given incident lines. The diff is returned
+    unchanged if there are no incident lines or no hunk is near any of them, since
+    the judge still needs to see the changes in that case.
+
+    """
+    if not lines:
+        return file_diff
+    kept = [
+        hunk for hunk in file_diff.hunks
+        if any(hunk.old_start - context <= line <= hunk.old_end + context for line in lines)
+    ]
+    if not kept:
+        return file_diff
+    return FileDiff(
+        header=file_diff.header,
+        hunks=kept,
+        omitted_hunks=file_diff.omitted_hunks + len(file_diff.hunks) - len(kept),
+    )
+
+
+def chunk_diff(file_diff: FileDiff, max_tokens: int) -> List[FileDiff]:
+    """
+    Splits a FileDiff into consecutive runs of hunks whose rendered size is at
+    most max_tokens each. A single hunk larger than max_tokens becomes a chunk
+    of its own.
+
+    """
+    header_tokens = estimate_tokens("\n".join(file_diff.header))
+    chunks = []
+    current = []
+    current_tokens = header_tokens
+    for hunk in file_diff.hunks:
+        hunk_tokens = estimate_tokens("\n".join(hunk.lines))
+        if current and current_tokens + hunk_tokens > max_tokens:
+            chunks.append(current)
+            current = []
+            current_tokens = header_tokens
+        current.append(hunk)
+        current_tokens += hunk_tokens
+    if current or not chunks:
+        chunks.append(current)
+
+    # the note about omitted hunks only needs to be seen once
+    return [
+        FileDiff(header=file_diff.header, hunks=hunks, omitted_hunks=file_diff.omitted_hunks if i == 0 else 0)
+        for i, hunks in enumerate(chunks)
+    ]
@@ -0,0 +1,156 @@
+#
+# endpoints.py
+# Spreads judge calls across a pool of equivalent model endpoints, e.g. several
+# deployments of or credentials for the same judge model, so that throughput
+# isn't limited by a single endpoint's rate limit.
+#
+import threading
+import time
+
+# error codes some providers use for throttling, e.g. botocore's ClientError
+THROTTLING_CODES = ("Throttling", "ThrottlingException", "TooManyRequestsException", "RateLimitExceeded")
+
+
+def status_code(error: BaseException):
+    """
+    Returns the HTTP status code carried by a provider's exception, if any.
+
+    """
+    code = getattr(error, "status_code", None)
+    if isinstance(code, int):
+        return code
+    response = getattr(error, "response", None)
+    code = getattr(response, "status_code", None)
+    if isinstance(code, int):
+        return code
+    if isinstance(response, dict):
+        return response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return None
+
+
+def is_ejectable(error: BaseException) -> bool:
+    """
+    Returns whether an error means that the endpoint is rate limiting us or is
+    unhealthy, rather than something being wrong with the request itself.
+
+    """
+    code = status_code(error)
+    if code is not None:
+        return code == 429 or code >= 500
+    response = getattr(error, "response", None)
+    if isinstance(response, dict) and response.get("Error", {}).get("Code") in THROTTLING_CODES:
+        return True
+    name = type(error).__name__
+    return "RateLimit" in name or "Throttl" in name or "ServiceUnavailable" in name
+
+
+class Endpoint:
+
+    def __init__(self, name: str, model_provider):
+        self.name = name
+        self.model_provider = model_provider
+        self.outstanding = 0
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.ejections = 0
+        self.consecutive_ejections = 0
+        self.ejected_until = 0.0
+        self.latency_seconds = 0.0
+        self.first_request_at = None
+
+    @property
+    def llm(self):
+        return self.model_provider.llm
+
+    def stats(self, now: float) -> dict:
+        elapsed = now - self.first_request_at if self.first_request_at else 0.0
+        return {
+            "endpoint": self.name,
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "mean_latency": self.latency_seconds / self.successes if self.successes else None,
+            "throughput_per_minute": 60 * self.successes / elapsed if elapsed else None,
+        }
+
+
+class EndpointPool:
+    """
+    Sends each call to the endpoint with the fewest outstanding requests. An endpoint
+    that returns a rate limit or server error is ejected from the pool for
+    ejection_seconds, doubling with each consecutive ejection up to max_ejection_seconds,
+    and the call is retried on another endpoint.
+
+    """
+
+    def __init__(self, endpoints: list, ejection_seconds: float = 30.0, max_ejection_seconds: float = 600.0):
+        self.endpoints = endpoints
+        self.ejection_seconds = ejection_seconds
+        self.max_ejection_seconds = max_ejection_seconds
+        self._lock = threading.Lock()
+
+    def acquire(self, exclude=()) -> Endpoint:
+        with self._lock:
+            now = time.time()
+            candidates = [e for e in self.endpoints if e not in exclude] or self.endpoints
+            available = [e for e in candidates if e.ejected_until <= now]
+            if available:
+                endpoint = min(available, key=lambda e: (e.outstanding, e.requests))
+            else:
+                # everything is ejected, use the endpoint that will be back soonest rather than failing
+                endpoint = min(candidates, key=lambda e: e.ejected_until)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            if endpoint.first_request_at is None:
+                endpoint.first_request_at = now
+            return endpoint
+
+    def release(self, endpoint: Endpoint, elapsed: float, error: BaseException = None):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if error is None:
+                endpoint.successes += 1
+                endpoint.consecutive_ejections = 0
+                endpoint.latency_seconds += elapsed
+                return
+            endpoint.failures += 1
+            if is_ejectable(error):
+                backoff = self.ejection_seconds * 2 ** endpoint.consecutive_ejections
+                endpoint.ejected_until = time.time() + min(backoff, self.max_ejection_seconds)
+                endpoint.ejections += 1
+                endpoint.consecutive_ejections += 1
+
+    def call(self, fn, avoid: list = None):
+        """
+        Returns fn(endpoint) for the least loaded endpoint, retrying on other endpoints
+        for as long as the endpoints tried fail with ejectable errors.
+
+        Args:
+            fn: the call to make, given the endpoint to make it to.
+            avoid: endpoints to pass over while others are available. Every endpoint
+                used is appended to it, so that concurrent calls sharing the list, e.g.
+                a hedged call and its duplicate, go to different endpoints.
+        """
+        tried = []
+        while True:
+            endpoint = self.acquire(exclude=tried + list(avoid or ()))
+            if avoid is not None:
+                avoid.append(endpoint)
+            start = time.time()
+            try:
+                result = fn(endpoint)
+            except Exception as e:
+                self.release(endpoint, time.time() - start, e)
+                tried.append(endpoint)
+                if not is_ejectable(e) or len(tried) >= len(self.endpoints):
+                    raise
+                continue
+            self.release(endpoint, time.time() - start)
+            return result
+
+    def stats(self) -> list:
+        with self._lock:
+            now = time.time()
+            return [endpoint.stats(now) for endpoint in self.endpoints]
@@ -3,10 +3,15 @@ import os
 import re
 import sys
 import yaml
+import hashlib
 import pydantic
 import argparse
+import time
+import threading
 import traceback
-from typing import List
+from functools import lru_cache
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from langchain.output_parsers import YamlOutputParser
 from langchain_core.prompts import PromptTemplate
@@ -16,7 +21,18 @@ from langchain_core.output_parsers import StrOutputParser, BaseTransformOutputPa
 sys.path.append("../kai")
 from kai.kai_config import KaiConfig
 from kai.llm_interfacing.model_provider import ModelProvider
+from diffs import chunk_diff, estimate_tokens, incident_lines, parse_diff, prune_diff
+import incidents
+from endpoints import Endpoint, EndpointPool
+from hedging import Hedger
+from incident_index import incident_coverage
 from prompts import JUDGE_PROMPT, RESULT_PROMPT, LANGCHAIN_PROMPT_TEMPLATE
+from sampling import StratifiedSampler, average_score, stratified_estimate
+from sharding import WorkQueue, in_shard
+
+
+# longest wait between checks of a work queue whose remaining files are claimed by other workers
+QUEUE_POLL_SECONDS = 30
 
 
 @dataclass
@@ -32,10 +48,16 @@ class PromptVars:
     target: str = ""
     filename: str = ""
     incidents: list = field(default_factory=list)
+    # str(incidents), rendered once per file and shared by all of its runs
+    rendered_incidents: str = ""
 
 
 class EvaluationResult(pydantic.BaseModel):
     filename: str
+    run: Optional[str] = pydantic.Field(
+        default=None,
+        description="The name of the Kai run the changes were made by, when evaluating several runs at once."
+    )
     effectiveness: int = pydantic.Field(
         description="A grade from 0 to 10 of how effectively the changes migrate the file from the source technology "
                     "to the target technology."
@@ -59,6 +81,42 @@ class EvaluationResult(pydantic.BaseModel):
     detailed_notes: str = pydantic.Field(
         description="Freeform explanation of the grades given to the model under evaluation."
     )
+    stratum: Optional[str] = pydantic.Field(
+        default=None,
+        description="The sampling stratum the file was drawn from when evaluating a sample."
+    )
+    stratum_size: Optional[int] = pydantic.Field(
+        default=None,
+        description="The number of files in the sampling stratum the file was drawn from."
+    )
+    diff_tokens: Optional[int] = pydantic.Field(
+        default=None,
+        description="Estimated number of tokens in the file's full diff."
+    )
+    evaluated_diff_tokens: Optional[int] = pydantic.Field(
+        default=None,
+        description="Estimated number of tokens of diff sent to the judge after pruning, across all chunks."
+    )
+    chunks: Optional[int] = pydantic.Field(
+        default=None,
+        description="The number of chunks the diff was split into for evaluation."
+    )
+    incidents_addressed: Optional[int] = pydantic.Field(
+        default=None,
+        description="The number of incidents with a changed line near their line number."
+    )
+    incidents_untouched: Optional[int] = pydantic.Field(
+        default=None,
+        description="The number of incidents with no changed line near their line number."
+    )
+    changed_lines_outside_incidents: Optional[int] = pydantic.Field(
+        default=None,
+        description="The number of changed lines that are not near any incident."
+    )
+    tier: Optional[str] = pydantic.Field(
+        default=None,
+        description="The judge tier that produced the report card, when evaluations are routed across tiers."
+    )
 
     def score_summary(self) -> float:
         score = self.effectiveness
@@ -103,11 +161,55 @@ class EvaluationOutputParser(BaseTransformOutputParser[str]):
         return result
 
 
+@dataclass
+class JudgeTier:
+    name: str
+    # the largest prompt, in estimated tokens, routed to this tier, None for no limit
+    max_prompt_tokens: Optional[int]
+    pool: EndpointPool
+    # each tier has its own hedger, latencies of a small and a long context model have little in common
+    hedger: Optional[Hedger] = None
+
+
 class Evaluator:
 
-    def __init__(self, config: KaiConfig):
+    def __init__(self, config: KaiConfig, hedger: Hedger = None, model_configs: list = None,
+                 tiers: List[JudgeTier] = None, default_tier_max_tokens: int = None):
+        """
+        Args:
+            config: the KaiConfig of the judge.
+            hedger: duplicates judge calls to the default tier that are slower than usual when set,
+                see hedging.py.
+            model_configs: the model configs of a pool of equivalent judge endpoints to spread calls
+                across, defaults to config.models alone.
+            tiers: judge tiers besides the default one made of model_configs, e.g. a small model for
+                small diffs and a long context model for large ones.
+            default_tier_max_tokens: the largest prompt routed to the default tier.
+        """
         self.config = config
-        self.model_provider = ModelProvider(config.models)
+        model_configs = model_configs or [config.models]
+        self.pool = EndpointPool([
+            Endpoint(f"{i}:{model_config.provider}", ModelProvider(model_config))
+            for i, model_config in enumerate(model_configs)
+        ])
+        self.model_provider = self.pool.endpoints[0].model_provider
+        self.tiers = sorted(
+            [JudgeTier("default", default_tier_max_tokens, self.pool, hedger)] + list(tiers or []),
+            key=lambda tier: (tier.max_prompt_tokens is None, tier.max_prompt_tokens or 0)
+        )
+        if len(set(tier.name for tier in self.tiers)) < len(self.tiers):
+            raise ValueError("Judge tier names must be unique")
+        if sum(tier.max_prompt_tokens is None for tier in self.tiers) > 1:
+            # the one sorted first would take every large prompt and the others would never be routed to
+            raise ValueError("Only one judge tier can take prompts of any size")
+        self.tier_counts = {tier.name: 0 for tier in self.tiers}
+        self.escalations = 0
+        # report cards by hash of the rendered prompt, so that identical changes made by
+        # different runs are only sent to the judge once
+        self.cache = {}
+        self.cache_hits = 0
+        # guards the counters, evaluate is called from judge worker and chunk threads
+        self._stats_lock = threading.Lock()
 
     def evaluate(self, prompt_vars: PromptVars, llm_result: LLMResult) -> EvaluationResult:
         """
@@ -115,18 +217,101 @@ class Evaluator:
 
         """
 
-        chain = self.model_provider.llm | StrOutputParser()
-        response = chain.invoke(render_messages(prompt_vars, llm_result))
-        extracted = extract_yaml_from_text(response)
-        return EvaluationResult(
-            filename=prompt_vars.filename,
-            effectiveness=extracted["effectiveness"],
-            specificity=extracted["specificity"],
-            competency=extracted["competency"],
-            valid_code=extracted["valid_code"],
-            unnecessary_changes=extracted["unnecessary_changes"],
-            detailed_notes=extracted["detailed_notes"]
-        )
+        messages = render_messages(prompt_vars, llm_result)
+        key = hashlib.sha256("\0".join(m.content for m in messages).encode("utf-8")).hexdigest()
+        cached = self.cache.get(key)
+        if cached is not None:
+            with self._stats_lock:
+                self.cache_hits += 1
+            return cached.model_copy()
+
+        index = self.route(estimate_tokens("".join(m.content for m in messages)))
+        while True:
+            tier = self.tiers[index]
+            try:
+                if tier.hedger is None:
+                    extracted = self.judge(messages, tier.pool)
+                else:
+                    # the hedge goes to another endpoint than the call it duplicates where there is one
+                    used = []
+                    extracted = tier.hedger.run(lambda pool=tier.pool: self.judge(messages, pool, avoid=used))
+                result = EvaluationResult(
+                    filename=prompt_vars.filename,
+                    effectiveness=extracted["effectiveness"],
+                    specificity=extracted["specificity"],
+                    competency=extracted["competency"],
+                    valid_code=extracted["valid_code"],
+                    unnecessary_changes=extracted["unnecessary_changes"],
+                    detailed_notes=extracted["detailed_notes"]
+                )
+                break
+            except (ValueError, TypeError, KeyError, yaml.YAMLError):
+                # a report card that can't be parsed is usually the model struggling with the
+                # prompt, so give the next larger tier a go before giving up on the file
+                if index + 1 >= len(self.tiers):
+                    raise
+                index += 1
+                with self._stats_lock:
+                    self.escalations += 1
+                print(f"Couldn't parse the report card for {prompt_vars.filename} from tier {tier.name}, "
+                      f"retrying with tier {self.tiers[index].name}")
+
+        with self._stats_lock:
+            self.tier_counts[tier.name] += 1
+        if len(self.tiers) > 1:
+            result.tier = tier.name
+        self.cache[key] = result.model_copy()
+        return result
+
+    def route(self, prompt_tokens: int) -> int:
+        """
+        Returns the index of the smallest tier that takes a prompt of prompt_tokens,
+        or of the largest tier if none of them does.
+
+        """
+        for index, tier in enumerate(self.tiers):
+            if tier.max_prompt_tokens is None or prompt_tokens <= tier.max_prompt_tokens:
+                return index
+        return len(self.tiers) - 1
+
+    def judge(self, messages: list, pool: EndpointPool = None, avoid: list = None) -> dict:
+        """
+        Sends the rendered messages to the judge and returns its parsed report card.
+
+        """
+        pool = pool or self.pool
+        response = pool.call(lambda endpoint: (endpoint.llm | StrOutputParser()).invoke(messages), avoid=avoid)
+        return extract_yaml_from_text(response)
+
+    def evaluate_diff(self, prompt_vars: PromptVars, llm_result: LLMResult, prune_context: int = None,
+                      max_chunk_tokens: int = None, chunk_workers: int = 4) -> EvaluationResult:
+        """
+        Evaluates the work done by Kai like `evaluate`, after optionally dropping the hunks of the
+        diff that are more than prune_context lines away from any incident and splitting the rest
+        into chunks of at most max_chunk_tokens that are evaluated in parallel.
+
+        """
+        file_diff = parse_diff(llm_result.diff)
+        if prune_context is not None:
+            file_diff = prune_diff(file_diff, incident_lines(prompt_vars.incidents), prune_context)
+        chunks = chunk_diff(file_diff, max_chunk_tokens) if max_chunk_tokens else [file_diff]
+        chunk_results = [LLMResult(diff=chunk.render()) for chunk in chunks]
+
+        if len(chunks) == 1:
+            result = self.evaluate(prompt_vars, chunk_results[0])
+        else:
+            with ThreadPoolExecutor(max_workers=min(chunk_workers, len(chunks))) as executor:
+                results = list(executor.map(lambda r: self.evaluate(prompt_vars, r), chunk_results))
+            result = merge_chunk_results(results, [chunk.changed_lines() for chunk in chunks])
+            if results[0].tier is not None:
+                # chunks may have gone to different tiers, credit the largest one used
+                names = [tier.name for tier in self.tiers]
+                result.tier = max((r.tier for r in results), key=names.index)
+
+        result.diff_tokens = estimate_tokens(llm_result.diff)
+        result.evaluated_diff_tokens = sum(estimate_tokens(r.diff) for r in chunk_results)
+        result.chunks = len(chunks)
+        return result
 
     # for some reason this doesn't work as well as `evaluate`. the `detailed_notes` field gets cut off.
     # leaving this in so that the reason it fails to return the complete output can be explored later.
@@ -155,6 +340,36 @@ class Evaluator:
         return result
 
 
+def merge_chunk_results(results: List[EvaluationResult], weights: List[int]) -> EvaluationResult:
+    """
+    Combines the evaluations of the chunks of a diff into one. Scores are averaged
+    weighted by the number of changed lines in each chunk and rounded, the code is
+    only valid if every chunk is valid, and the changes are unnecessary if any chunk
+    made unnecessary changes.
+
+    """
+    # a chunk with no changed lines still counts for something
+    weights = [max(weight, 1) for weight in weights]
+    total = sum(weights)
+
+    def weighted(name):
+        return round(sum(getattr(r, name) * w for r, w in zip(results, weights)) / total)
+
+    notes = [
+        f"Chunk {i} of {len(results)}:\n{r.detailed_notes}"
+        for i, r in enumerate(results, 1)
+    ]
+    return EvaluationResult(
+        filename=results[0].filename,
+        effectiveness=weighted("effectiveness"),
+        specificity=weighted("specificity"),
+        competency=weighted("competency"),
+        valid_code=all(r.valid_code for r in results),
+        unnecessary_changes=any(r.unnecessary_changes for r in results),
+        detailed_notes="\n\n".join(notes)
+    )
+
+
 def extract_yaml_from_text(text: str) -> dict:
     """
     Extracts a YAML chunk wrapped in triple backticks from a larger text
@@ -188,6 +403,17 @@ def extract_yaml_from_text(text: str) -> dict:
         raise ValueError("No YAML block found.")
 
 
+@lru_cache(maxsize=None)
+def render_judge_prompt(model: str, source: str, target: str, language: str) -> str:
+    # the system prompt is the same for every file
+    return JUDGE_PROMPT.render(
+        model=model,
+        source=source,
+        target=target,
+        language=language,
+    )
+
+
 def render_messages(prompt_vars: PromptVars, llm_results: LLMResult) -> list:
     """
     Takes the Kai input and output to be evaluated and converts it into
@@ -195,16 +421,16 @@ def render_messages(prompt_vars: PromptVars, llm_results: LLMResult) -> list:
 
     """
 
-    judge = JUDGE_PROMPT.render(
-        model=prompt_vars.model,
-        source=prompt_vars.source,
-        target=prompt_vars.target,
-        language=prompt_vars.language,
+    judge = render_judge_prompt(
+        prompt_vars.model,
+        prompt_vars.source,
+        prompt_vars.target,
+        prompt_vars.language,
     )
     result = RESULT_PROMPT.render(
         model=prompt_vars.model,
         filename=prompt_vars.filename,
-        incidents=prompt_vars.incidents,
+        incidents=prompt_vars.rendered_incidents or prompt_vars.incidents,
         updated_file=llm_results.diff
     )
     messages = [
@@ -220,40 +446,267 @@ def get_config(config_path: str) -> KaiConfig:
     return KaiConfig.model_validate_filepath(config_path)
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-l", "--language", dest="language", default="Java")
-    parser.add_argument("-s", "--source", dest="source_technology", default="JavaEE")
-    parser.add_argument("-t", "--target", dest="target_technology", default="Quarkus")
-    parser.add_argument("-c", "--config", default="config.toml")
-    parser.add_argument("input_file", help="path to unified result file produced by parse_kai_logs.py")
-    parser.add_argument("output_file")
-    args = parser.parse_args()
-    config = get_config(args.config)
-    evaluator = Evaluator(config)
+def load_parsed_logs(path: str) -> dict:
+    """
+    Loads the output of parse_kai_logs.py, in either of its encodings.
 
-    results = []
-    k = None
-    with open(args.input_file) as f:
-        ks = yaml.safe_load(f)
+    """
+    if incidents.is_compact(path):
+        return incidents.load(path)
+    with open(path) as f:
+        return yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+
+def build_prompt_vars(args, file_uri: str, entry: dict) -> PromptVars:
+    prompt_vars = PromptVars()
+    prompt_vars.source = args.source_technology
+    prompt_vars.target = args.target_technology
+    prompt_vars.language = args.language
+    prompt_vars.incidents = entry['incidents']
+    prompt_vars.rendered_incidents = entry.get('rendered_incidents', "")
+    prompt_vars.filename = entry.get('filename', file_uri)
+    return prompt_vars
+
+
+def expand_runs(ks: dict) -> dict:
+    """
+    Returns the entries of a parsed log with a diff, keyed by work item. Files
+    parsed with several runs get an entry per run, which shares the file's
+    incidents and their rendering with the other runs.
+
+    """
+    expanded = {}
     for file_uri, v in ks.items():
-        if 'diff' not in v or v['diff'] == "":
-            print(f"No fix for file: {file_uri}")
+        if 'runs' not in v:
+            if 'diff' not in v or v['diff'] == "":
+                print(f"No fix for file: {file_uri}")
+                continue
+            expanded[file_uri] = v
             continue
-        prompt_vars = PromptVars()
-        prompt_vars.source = args.source_technology
-        prompt_vars.target = args.target_technology
-        prompt_vars.language = args.language
-        prompt_vars.incidents = v['incidents']
-        prompt_vars.filename = file_uri
-        llm_result = LLMResult()
-        llm_result.diff = v['diff']
 
-        try:
+        shared = {k: value for k, value in v.items() if k != 'runs'}
+        shared['rendered_incidents'] = str(v['incidents'])
+        for run, diff in v['runs'].items():
+            if diff == "":
+                print(f"No fix for file: {file_uri} in run {run}")
+                continue
+            expanded[f"{file_uri}#{run}"] = dict(shared, filename=file_uri, run=run, diff=diff)
+    return expanded
+
+
+def evaluate_file(evaluator: Evaluator, args, file_uri: str, entry: dict) -> Optional[EvaluationResult]:
+    prompt_vars = build_prompt_vars(args, file_uri, entry)
+    llm_result = LLMResult()
+    llm_result.diff = entry['diff']
+
+    try:
+        if args.prune_context is None and args.max_chunk_tokens is None:
             result = evaluator.evaluate(prompt_vars, llm_result)
-            results.append(result.__dict__)
-        except BaseException:
-            print("Couldn't evaluate response for file: ", prompt_vars.filename)
-            print(traceback.format_exc())
+        else:
+            result = evaluator.evaluate_diff(prompt_vars, llm_result, args.prune_context,
+                                             args.max_chunk_tokens, args.chunk_workers)
+            print(f"Evaluated {result.evaluated_diff_tokens} of {result.diff_tokens} diff tokens "
+                  f"in {result.chunks} chunks for file: {file_uri}")
+        result.run = entry.get('run')
+        coverage = incident_coverage(parse_diff(llm_result.diff), prompt_vars.incidents)
+        result.incidents_addressed = coverage.incidents_addressed
+        result.incidents_untouched = coverage.incidents_untouched
+        result.changed_lines_outside_incidents = coverage.changed_lines_outside_incidents
+        return result
+    except BaseException:
+        print("Couldn't evaluate response for file: ", prompt_vars.filename)
+        print(traceback.format_exc())
+        return None
+
+
+def evaluate_sample(evaluator: Evaluator, args, ks: dict) -> list:
+    """
+    Evaluates batches of a stratified sample of the fixed files until the confidence
+    interval of the estimated average score is narrower than args.ci_width. When
+    evaluating several runs, each run is sampled and estimated on its own, and
+    sampling goes on until every run's interval is narrow enough.
+
+    """
+    populations = {}
+    for file_uri, entry in ks.items():
+        populations.setdefault(entry.get("run"), {})[file_uri] = entry
+    samplers = {run: StratifiedSampler(population, seed=args.seed) for run, population in populations.items()}
+    results = {run: [] for run in samplers}
+    for run, sampler in samplers.items():
+        print(f"Sampling {f'run {run} ' if run else ''}from {sampler.total} files in {len(sampler.strata)} strata")
+
+    sampling = set(samplers)
+    while sampling:
+        batch = [
+            (run, file_uri)
+            for run in sorted(sampling, key=lambda run: run or "")
+            for file_uri in samplers[run].next_batch(args.sample_batch)
+        ]
+        with ThreadPoolExecutor(max_workers=args.judge_workers) as executor:
+            batch_results = list(executor.map(lambda item: evaluate_file(evaluator, args, item[1], ks[item[1]]),
+                                              batch))
+        for (run, file_uri), result in zip(batch, batch_results):
+            if result is None:
+                continue
+            sampler = samplers[run]
+            result.stratum = sampler.stratum_by_file[file_uri]
+            result.stratum_size = sampler.sizes[result.stratum]
+            results[run].append(result.model_dump(exclude_none=True))
+
+        for run in sorted(sampling, key=lambda run: run or ""):
+            sampler = samplers[run]
+            if sampler.exhausted():
+                sampling.discard(run)
+            if not results[run]:
+                continue
+            mean, half_width = stratified_estimate(results[run], average_score, args.confidence)
+            print(f"{f'Run {run}: e' if run else 'E'}valuated {sampler.drawn_total} of {sampler.total} files, "
+                  f"estimated average score {mean:.2f} +/- {half_width:.2f}")
+            # the interval only covers the strata drawn so far, keep drawing until it covers them all
+            if sampler.covered() and 2 * half_width <= args.ci_width:
+                sampling.discard(run)
+    return [result for run in samplers for result in results[run]]
+
+
+def evaluate_from_queue(evaluator: Evaluator, args, ks: dict) -> list:
+    """
+    Claims files from the shared work queue until it is drained, appending each
+    result to args.output_file as it completes so that the partial results
+    survive the worker being stopped. The queue is only drained once no file is
+    claimed, files held by a worker that crashed are picked up when their lease
+    expires.
+
+    """
+    queue = WorkQueue(args.queue, lease_seconds=args.lease)
+    queue.populate(ks.keys())
+    if args.retry_failed:
+        print(f"Retrying {queue.retry_failed()} failed files")
+    results = []
+    lock = threading.Lock()
+
+    def work(worker_id: str):
+        # a connection per thread, sqlite3 connections can't be shared between threads
+        worker_queue = WorkQueue(args.queue, lease_seconds=args.lease)
+        try:
+            while True:
+                file_uri = worker_queue.claim(worker_id)
+                if file_uri is None:
+                    expiry = worker_queue.next_expiry()
+                    if expiry is None:
+                        break
+                    # other workers still hold files, wait for them to finish or for a lease to expire
+                    time.sleep(min(expiry, QUEUE_POLL_SECONDS) + 0.1)
+                    continue
+                if file_uri not in ks:
+                    # queued by a worker with a different input file
+                    print(f"Skipping unknown file from queue: {file_uri}")
+                    worker_queue.complete(file_uri, worker_id, succeeded=False)
+                    continue
+                result = evaluate_file(evaluator, args, file_uri, ks[file_uri])
+                if result is not None:
+                    with lock:
+                        results.append(result.model_dump(exclude_none=True))
+                        # a yaml list of one, appended lists read back as a single list
+                        yaml.dump(results[-1:], output)
+                        output.flush()
+                if not worker_queue.complete(file_uri, worker_id, succeeded=result is not None):
+                    # merge_evaluations drops the duplicate if the other worker finishes it too
+                    print(f"Lease on {file_uri} expired during its evaluation and it was handed to another worker")
+        finally:
+            worker_queue.close()
+
+    try:
+        # appended to, so that rerunning a worker that was stopped keeps the results it already wrote
+        with open(args.output_file, "a") as output:
+            if args.judge_workers == 1:
+                work(args.worker_id)
+            else:
+                with ThreadPoolExecutor(max_workers=args.judge_workers) as executor:
+                    # claims are per thread so that each thread can only complete its own files
+                    list(executor.map(work, [f"{args.worker_id}-{i}" for i in range(args.judge_workers)]))
+        print(f"Queue drained: {queue.counts()}")
+        failed = queue.failed()
+        if failed:
+            print(f"{len(failed)} files failed, rerun with --retry-failed to evaluate them again:")
+            for file_uri in failed:
+                print(f"  {file_uri}")
+    finally:
+        queue.close()
+    return results
+
+
+def build_evaluator(args) -> Evaluator:
+    def hedger():
+        if not args.hedge:
+            return None
+        return Hedger(max_rate=args.hedge_max_rate, quantile=args.hedge_quantile,
+                      initial_delay=args.hedge_initial_delay)
+
+    config = get_config(args.config)
+    model_configs = [config.models] + [get_config(path).models for path in args.judge_config]
+    tiers = []
+    for name, max_tokens, path in args.tier:
+        models = get_config(path).models
+        pool = EndpointPool([Endpoint(f"{name}:{models.provider}", ModelProvider(models))])
+        tiers.append(JudgeTier(name, max_tokens, pool, hedger()))
+    return Evaluator(config, hedger=hedger(), model_configs=model_configs, tiers=tiers,
+                     default_tier_max_tokens=args.default_tier_max_tokens)
+
+
+def print_judge_stats(evaluator: Evaluator):
+    if evaluator.cache_hits:
+        print(f"Reused {evaluator.cache_hits} judge results for identical changes")
+    for tier in evaluator.tiers:
+        if tier.hedger is None:
+            continue
+        stats = tier.hedger.stats()
+        print(f"Hedged {stats['hedges_issued']} of {stats['calls']} judge calls"
+              + (f" to tier {tier.name}" if len(evaluator.tiers) > 1 else "")
+              + f", {stats['hedges_won']} hedges returned first")
+    if len(evaluator.tiers) > 1:
+        print("Judge tiers: " + ", ".join(f"{name} {count}" for name, count in evaluator.tier_counts.items())
+              + f" evaluations, {evaluator.escalations} escalated to a larger tier")
+    if len(evaluator.pool.endpoints) > 1:
+        for stats in evaluator.pool.stats():
+            throughput = stats["throughput_per_minute"]
+            print(f"Endpoint {stats['endpoint']}: {stats['successes']} of {stats['requests']} requests succeeded, "
+                  f"ejected {stats['ejections']} times"
+                  + (f", {throughput:.1f} evaluations per minute" if throughput is not None else ""))
+
+
+def main(args):
+    evaluator = build_evaluator(args)
+
+    ks = load_parsed_logs(args.input_file)
+    fixed = {}
+    for key, v in expand_runs(ks).items():
+        # shard by file rather than by run so that a file's runs share a judge cache
+        if args.shard and not in_shard(v.get('filename', key), args.shard):
+            continue
+        fixed[key] = v
+
+    if args.sample:
+        results = evaluate_sample(evaluator, args, fixed)
+    elif args.queue:
+        results = evaluate_from_queue(evaluator, args, fixed)
+    else:
+        with ThreadPoolExecutor(max_workers=args.judge_workers) as executor:
+            # map returns the results in input order whichever finishes first
+            evaluated = executor.map(lambda item: evaluate_file(evaluator, args, *item), fixed.items())
+            results = [result.model_dump(exclude_none=True) for result in evaluated if result is not None]
+    print_judge_stats(evaluator)
+    if args.queue:
+        # the results have already been appended to the output as they completed
+        return
     with open(args.output_file, "w") as f:
         yaml.dump(results, f)
+
+
+if __name__ == "__main__":
+    import kai_eval
+
+    parser = argparse.ArgumentParser()
+    kai_eval.add_evaluate_arguments(parser)
+    args = parser.parse_args()
+    kai_eval.check_evaluate_arguments(parser, args)
+    main(args)
@@ -8,20 +8,32 @@
 import csv
 import argparse
 import json
+import math
 import yaml
 
+from sampling import SCORE_FIELDS, average_score, stratified_estimate
 
-def generate_csv_report(evaluations, output):
+
+def generate_csv_report(evaluations, output, confidence=0.95):
+    # only evaluations of several runs at once have a run column
+    has_runs = any(evaluation.get("run") is not None for evaluation in evaluations)
+    has_coverage = any(evaluation.get("incidents_addressed") is not None for evaluation in evaluations)
+    has_tiers = any(evaluation.get("tier") is not None for evaluation in evaluations)
     with open(output, 'w') as output_file:
         writer = csv.writer(output_file)
-        writer.writerow([
+        writer.writerow(([
             "File",
+            "Run"] if has_runs else ["File"]) + [
             "Effectiveness",
             "Specificity",
             "Competency",
             "Valid Code",
             "Unnecessary Changes",
-            "Average Score"])
+            "Average Score"] + ([
+            "Incidents Addressed",
+            "Incidents Untouched",
+            "Changed Lines Outside Incidents"] if has_coverage else []) + (
+            ["Tier"] if has_tiers else []))
         for evaluation in evaluations:
             row = [
                 evaluation["filename"],
@@ -33,18 +45,70 @@ def generate_csv_report(evaluations, output):
             ]
             avg = sum(row[1:5]) / 4.0
             row.append(avg)
+            if has_coverage:
+                row.extend([
+                    evaluation.get("incidents_addressed"),
+                    evaluation.get("incidents_untouched"),
+                    evaluation.get("changed_lines_outside_incidents")
+                ])
+            if has_tiers:
+                row.append(evaluation.get("tier"))
+            if has_runs:
+                row.insert(1, evaluation.get("run"))
             writer.writerow(row)
 
     print(f"CSV file generated at {output}")
+    print_estimates(evaluations, confidence)
+    print_token_savings(evaluations)
 
 
-def generate_json_report(evaluations, output):
-    data = []
+def average_rows(data):
     total_effectiveness = 0
     total_specificity = 0
     total_competency = 0
     total_average_score = 0
 
+    for row in data:
+        total_effectiveness += row["effectiveness"]
+        total_specificity += row["specificity"]
+        total_competency += row["competency"]
+        total_average_score += row["averageScore"]
+
+    total_incidents = len(data)
+    return {
+        "averageEffectiveness": round(total_effectiveness / total_incidents, 1),
+        "averageSpecificity": round(total_specificity / total_incidents, 1),
+        "averageCompetency": round(total_competency / total_incidents, 1),
+        "averageScore": round(total_average_score / total_incidents, 1),
+    }
+
+
+def average_rows_by(data, key):
+    groups = {}
+    for row in data:
+        if row.get(key) is not None:
+            groups.setdefault(row[key], []).append(row)
+    return {name: average_rows(rows) for name, rows in sorted(groups.items())}
+
+
+def total_coverage(data):
+    rows = [row for row in data if "incidentsAddressed" in row]
+    if not rows:
+        return None
+    addressed = sum(row["incidentsAddressed"] for row in rows)
+    untouched = sum(row["incidentsUntouched"] for row in rows)
+    return {
+        "incidentsAddressed": addressed,
+        "incidentsUntouched": untouched,
+        "addressedRatio": round(addressed / max(addressed + untouched, 1), 3),
+        "changedLinesOutsideIncidents": sum(row["changedLinesOutsideIncidents"] for row in rows),
+        "filesWithUntouchedIncidents": sum(1 for row in rows if row["incidentsUntouched"]),
+    }
+
+
+def generate_json_report(evaluations, output, confidence=0.95):
+    data = []
+
     for evaluation in evaluations:
         row = {
             "file": evaluation["filename"],
@@ -54,56 +118,141 @@ def generate_json_report(evaluations, output):
             "validCode": evaluation["valid_code"],
             "unnecessaryChanges": evaluation["unnecessary_changes"],
         }
+        if evaluation.get("run") is not None:
+            row["run"] = evaluation["run"]
+        if evaluation.get("incidents_addressed") is not None:
+            row["incidentsAddressed"] = evaluation["incidents_addressed"]
+            row["incidentsUntouched"] = evaluation["incidents_untouched"]
+            row["changedLinesOutsideIncidents"] = evaluation["changed_lines_outside_incidents"]
+        if evaluation.get("tier") is not None:
+            row["tier"] = evaluation["tier"]
+        if evaluation.get("diff_tokens") is not None:
+            row["diffTokens"] = evaluation["diff_tokens"]
+            row["evaluatedDiffTokens"] = evaluation["evaluated_diff_tokens"]
         row["averageScore"] = round(sum([
             row["effectiveness"],
             row["specificity"],
             row["competency"]
         ]) / 4.0, 1)
 
-        total_effectiveness += row["effectiveness"]
-        total_specificity += row["specificity"]
-        total_competency += row["competency"]
-        total_average_score += row["averageScore"]
-
         data.append(row)
 
     if not data:
         raise ValueError("No incidents were reported")
 
-    total_incidents = len(data)
-    averages = {
-        "averageEffectiveness": round(total_effectiveness / total_incidents, 1),
-        "averageSpecificity": round(total_specificity / total_incidents, 1),
-        "averageCompetency": round(total_competency / total_incidents, 1),
-        "averageScore": round(total_average_score / total_incidents, 1),
-    }
-
     result = {
-        **averages,
+        **average_rows(data),
         "data": data
     }
+    runs = average_rows_by(data, "run")
+    if runs:
+        result["runs"] = runs
+    tiers = average_rows_by(data, "tier")
+    if tiers:
+        result["tiers"] = tiers
+    coverage = total_coverage(data)
+    if coverage:
+        result["coverage"] = coverage
+    estimates = estimate_scores(evaluations, confidence)
+    if estimates:
+        result["estimates"] = estimates
 
     with open(output, 'w') as output_file:
-        json.dump(result, output_file, indent=4)
+        json.dump(result, output_file, indent=4, allow_nan=False)
 
     print(f"JSON file generated at {output}")
+    print_estimates(evaluations, confidence)
+    print_token_savings(evaluations)
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("input_file", help="path to evaluation yaml")
-    parser.add_argument("output_file", help="path to write output file")
-    parser.add_argument("output_format", help="output format [csv | json]")
-    args = parser.parse_args()
+def estimate_scores(evaluations, confidence=0.95):
+    """
+    Returns the estimated population means and confidence intervals for an
+    evaluation produced by `evaluate.py --sample`, or None if the evaluation
+    was not sampled. Evaluations of several runs are estimated per run, under
+    "runs".
+
+    """
+    sampled = [e for e in evaluations if e.get("stratum") is not None]
+    if not sampled:
+        return None
+
+    runs = {}
+    for evaluation in sampled:
+        runs.setdefault(evaluation.get("run"), []).append(evaluation)
+    if None in runs:
+        return {"confidence": confidence, **estimate_sample(sampled, confidence)}
+    return {
+        "confidence": confidence,
+        "sampleSize": len(sampled),
+        "runs": {run: estimate_sample(runs[run], confidence) for run in sorted(runs)},
+    }
+
+
+def estimate_sample(sampled, confidence=0.95):
+    estimates = {"sampleSize": len(sampled)}
+    for name, value in [
+        ("effectiveness", lambda e: e["effectiveness"]),
+        ("specificity", lambda e: e["specificity"]),
+        ("competency", lambda e: e["competency"]),
+        ("averageScore", average_score),
+    ]:
+        mean, half_width = stratified_estimate(sampled, value, confidence)
+        # a single evaluation gives no interval, which JSON can't hold as infinity
+        bounded = math.isfinite(half_width)
+        estimates[name] = {
+            "mean": round(mean, 2),
+            "lower": round(mean - half_width, 2) if bounded else None,
+            "upper": round(mean + half_width, 2) if bounded else None,
+        }
+    return estimates
+
+
+def print_token_savings(evaluations):
+    pruned = [e for e in evaluations if e.get("diff_tokens") is not None]
+    if not pruned:
+        return
+    diff_tokens = sum(e["diff_tokens"] for e in pruned)
+    evaluated_tokens = sum(e["evaluated_diff_tokens"] for e in pruned)
+    saved = diff_tokens - evaluated_tokens
+    print(f"Diff pruning saved {saved} of {diff_tokens} estimated diff tokens "
+          f"({saved / max(diff_tokens, 1):.0%}) across {len(pruned)} files")
+
+
+def print_estimates(evaluations, confidence=0.95):
+    estimates = estimate_scores(evaluations, confidence)
+    if not estimates:
+        return
+    for run, run_estimates in estimates.get("runs", {None: estimates}).items():
+        print(f"Estimated means {f'of run {run} ' if run else ''}from a sample of {run_estimates['sampleSize']} "
+              f"files ({confidence:.0%} confidence intervals):")
+        for name in SCORE_FIELDS + ["averageScore"]:
+            estimate = run_estimates[name]
+            if estimate["lower"] is None:
+                print(f"  {name}: {estimate['mean']} (too few evaluations for an interval)")
+            else:
+                print(f"  {name}: {estimate['mean']} [{estimate['lower']}, {estimate['upper']}]")
+
+
+def main(args):
     with open(args.input_file) as input_file:
         evaluations = yaml.safe_load(input_file)
 
     if args.output_format.lower() == "csv":
-        generate_csv_report(evaluations, args.output_file)
-        exit(0)
+        generate_csv_report(evaluations, args.output_file, args.confidence)
+        return 0
 
     if args.output_format.lower() == "json":
-        generate_json_report(evaluations, args.output_file)
-        exit(0)
+        generate_json_report(evaluations, args.output_file, args.confidence)
+        return 0
 
     print(f"ERROR output format '{args.output_format}' not recognized")
+    return 1
+
+
+if __name__ == "__main__":
+    import kai_eval
+
+    parser = argparse.ArgumentParser()
+    kai_eval.add_report_arguments(parser)
+    exit(main(parser.parse_args()))
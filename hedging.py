@@ -0,0 +1,116 @@
+#
+# hedging.py
+# Request hedging for judge calls: when a call takes longer than most calls do,
+# a duplicate is issued and whichever returns a valid result first wins, which
+# cuts the long tail of judge latency at the cost of a capped number of extra
+# requests.
+#
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+
+class Hedger:
+    """
+    Runs calls with an adaptive hedge: if a call hasn't completed within the
+    observed `quantile` of recent call latencies, a duplicate is issued unless
+    hedges already make up `max_rate` of calls. A call that raises, e.g. because
+    the judge's report card couldn't be parsed, doesn't win, and the other
+    attempt is waited for instead.
+
+    A losing attempt can't be interrupted once its request is in flight, its
+    result is discarded when it completes. Attempts run on daemon threads so that
+    a hung losing attempt doesn't keep the process alive once the run is over.
+
+    """
+
+    def __init__(self, max_rate: float = 0.1, quantile: float = 0.95, initial_delay: float = 60.0,
+                 min_samples: int = 20, window: int = 200):
+        self.max_rate = max_rate
+        self.quantile = quantile
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.hedges_issued = 0
+        self.hedges_won = 0
+        self._lock = threading.Lock()
+
+    def delay(self) -> float:
+        """
+        Returns how long to wait for a call before hedging it: the configured quantile
+        of recent latencies, or initial_delay until enough calls have been observed.
+
+        """
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return self.initial_delay
+            latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(self.quantile * len(latencies)))]
+
+    def _timed(self, fn):
+        start = time.time()
+        result = fn()
+        with self._lock:
+            self.latencies.append(time.time() - start)
+        return result
+
+    def _submit(self, fn) -> Future:
+        # unlike a ThreadPoolExecutor's workers, these threads aren't joined at interpreter exit
+        future = Future()
+
+        def attempt():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self._timed(fn))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=attempt, name="hedge", daemon=True).start()
+        return future
+
+    def _try_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges_issued + 1 > self.max_rate * self.calls:
+                return False
+            self.hedges_issued += 1
+            return True
+
+    def run(self, fn):
+        """
+        Returns the result of fn(), hedging it if it is slow.
+
+        """
+        with self._lock:
+            self.calls += 1
+        primary = self._submit(fn)
+        done, _ = wait([primary], timeout=self.delay())
+        if done or not self._try_hedge():
+            return primary.result()
+
+        hedge = self._submit(fn)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                if future is hedge:
+                    with self._lock:
+                        self.hedges_won += 1
+                for other in pending:
+                    other.cancel()
+                return future.result()
+        raise error
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedges_issued": self.hedges_issued,
+                "hedges_won": self.hedges_won,
+            }
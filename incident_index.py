@@ -0,0 +1,146 @@
+#
+# incident_index.py
+# Links the incidents found by the analysis to the hunks of a file's diff with
+# interval trees, giving deterministic coverage metrics to cross-check the
+# judge's scores against: which incidents were addressed by a change, which were
+# left untouched, and how many changed lines are outside of any incident.
+#
+from dataclasses import dataclass
+from typing import List
+
+from diffs import FileDiff, Hunk, incident_lines
+
+# number of lines either side of an incident's line number that count as part of it
+INCIDENT_CONTEXT = 2
+
+
+class IntervalTree:
+    """
+    A static centered interval tree over closed integer intervals, each carrying
+    a value, answering which intervals overlap a query range.
+
+    """
+
+    def __init__(self, intervals: list):
+        """
+        Args:
+            intervals: (start, end, value) tuples with start <= end.
+        """
+        self.center = None
+        self.left = None
+        self.right = None
+        if not intervals:
+            return
+
+        endpoints = sorted(point for start, end, _ in intervals for point in (start, end))
+        self.center = endpoints[len(endpoints) // 2]
+        left, right, overlapping = [], [], []
+        for interval in intervals:
+            start, end, _ = interval
+            if end < self.center:
+                left.append(interval)
+            elif start > self.center:
+                right.append(interval)
+            else:
+                overlapping.append(interval)
+        self.by_start = sorted(overlapping, key=lambda i: i[0])
+        self.by_end = sorted(overlapping, key=lambda i: i[1], reverse=True)
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def overlapping(self, start: int, end: int) -> list:
+        """
+        Returns the values of the intervals that overlap [start, end].
+
+        """
+        values = []
+        self._query(start, end, values)
+        return values
+
+    def _query(self, start: int, end: int, values: list):
+        if self.center is None:
+            return
+        if end < self.center:
+            # every interval here contains the center, so it overlaps if it starts early enough
+            for interval_start, _, value in self.by_start:
+                if interval_start > end:
+                    break
+                values.append(value)
+            if self.left:
+                self.left._query(start, end, values)
+        elif start > self.center:
+            for _, interval_end, value in self.by_end:
+                if interval_end < start:
+                    break
+                values.append(value)
+            if self.right:
+                self.right._query(start, end, values)
+        else:
+            values.extend(value for _, _, value in self.by_start)
+            if self.left:
+                self.left._query(start, end, values)
+            if self.right:
+                self.right._query(start, end, values)
+
+
+def changed_positions(hunk: Hunk) -> List[int]:
+    """
+    Returns the line number in the original file of each changed line of a hunk.
+    Removed lines are at their own line number and added lines at the line number
+    of the original line they were inserted before.
+
+    """
+    positions = []
+    old_line = hunk.old_start
+    for line in hunk.lines[1:]:
+        if line.startswith("-"):
+            positions.append(old_line)
+            old_line += 1
+        elif line.startswith("+"):
+            positions.append(old_line)
+        elif not line.startswith("\\"):
+            # context line, "\ No newline at end of file" doesn't advance
+            old_line += 1
+    return positions
+
+
+@dataclass
+class IncidentCoverage:
+    incidents_addressed: int = 0
+    incidents_untouched: int = 0
+    changed_lines: int = 0
+    changed_lines_outside_incidents: int = 0
+
+
+def incident_coverage(file_diff: FileDiff, incidents: list, context: int = INCIDENT_CONTEXT) -> IncidentCoverage:
+    """
+    Computes the coverage of a file's incidents by its diff. An incident is addressed
+    when a changed line falls within context lines of its line number. Incidents
+    without a line number are not counted.
+
+    """
+    positions_by_hunk = [changed_positions(hunk) for hunk in file_diff.hunks]
+    hunk_tree = IntervalTree([
+        (min(positions), max(positions), i)
+        for i, positions in enumerate(positions_by_hunk)
+        if positions
+    ])
+    lines = incident_lines(incidents)
+    incident_tree = IntervalTree([(line - context, line + context, line) for line in lines])
+
+    coverage = IncidentCoverage()
+    for line in lines:
+        # a hunk's span may contain unchanged context lines, so check the changed lines themselves
+        hunks = hunk_tree.overlapping(line - context, line + context)
+        if any(line - context <= position <= line + context
+               for i in hunks for position in positions_by_hunk[i]):
+            coverage.incidents_addressed += 1
+        else:
+            coverage.incidents_untouched += 1
+
+    for positions in positions_by_hunk:
+        for position in positions:
+            coverage.changed_lines += 1
+            if not incident_tree.overlapping(position, position):
+                coverage.changed_lines_outside_incidents += 1
+    return coverage
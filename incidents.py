@@ -0,0 +1,256 @@
+#
+# incidents.py
+# A compact representation of the incidents in an analysis report, and an
+# on-disk encoding of the parsed incident map handed from parse_kai_logs.py to
+# evaluate.py that avoids round-tripping everything through YAML.
+#
+# Each incident is a slotted record with its uri, violation and message
+# interned, while its code snippet, variables and any other fields, including a
+# null uri, message or line number, are kept as UTF-8 encoded JSON in a shared
+# blob and only decoded when accessed. Fields JSON can't represent as loaded,
+# e.g. dates or mappings with non-string keys, are encoded as YAML instead.
+# Loaded files map the blob rather than reading it into memory.
+#
+import json
+import mmap
+import struct
+import sys
+from collections.abc import Mapping
+
+import yaml
+
+MAGIC = b"KAIEVAL-INCIDENTS\x01\n"
+HEADER_LENGTH = struct.Struct("<Q")
+
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+def _json_safe(value) -> bool:
+    """
+    Returns whether value comes back unchanged from a JSON round trip.
+
+    """
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return True
+    if isinstance(value, list):
+        return all(_json_safe(v) for v in value)
+    if isinstance(value, dict):
+        return all(isinstance(k, str) and _json_safe(v) for k, v in value.items())
+    return False
+
+
+def encode_extra(extra: dict) -> bytes:
+    # keys are sorted at every level, like the mappings of a parsed log loaded from yaml
+    if _json_safe(extra):
+        return json.dumps(extra, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    # a block style yaml mapping never starts with "{", which is how decode_extra tells them apart
+    return yaml.dump(extra, Dumper=YamlDumper, default_flow_style=False, allow_unicode=True).encode("utf-8")
+
+
+def decode_extra(encoded: bytes) -> dict:
+    if encoded[:1] == b"{":
+        return json.loads(encoded)
+    return yaml.load(encoded.decode("utf-8"), Loader=YamlLoader)
+
+
+class IncidentStore:
+    """
+    Owns the blob holding the lazily decoded fields of a set of incidents.
+
+    """
+
+    def __init__(self, blob=None):
+        self.blob = bytearray() if blob is None else blob
+        self._shapes = {}
+
+    def shape(self, keys: tuple) -> tuple:
+        # incidents mostly share the same few sets of extra keys, keep one copy of each
+        return self._shapes.setdefault(keys, keys)
+
+    def add(self, incident: dict, violation: str = None) -> "Incident":
+        """
+        Returns a compact Incident for an incident dict from the analysis output.
+
+        """
+        # uri, message and lineNumber have their own slots, which can't tell a null value from a
+        # missing key, so null values are kept with the other fields
+        extra = {k: v for k, v in incident.items() if k not in ("uri", "message", "lineNumber") or v is None}
+        offset = len(self.blob)
+        if extra:
+            self.blob += encode_extra(extra)
+        return Incident(
+            store=self,
+            uri=_intern(incident.get("uri")),
+            violation=_intern(violation),
+            message=_intern(incident.get("message")),
+            line_number=incident.get("lineNumber"),
+            extra_keys=self.shape(tuple(sorted(extra))),
+            offset=offset,
+            length=len(self.blob) - offset,
+        )
+
+    def extra(self, offset: int, length: int) -> dict:
+        if not length:
+            return {}
+        return decode_extra(bytes(self.blob[offset:offset + length]))
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Incident(Mapping):
+    """
+    A read-only incident that behaves like the incident dict it was made from, with
+    keys in sorted order like incidents loaded from YAML. Fields other than the uri,
+    message and line number are decoded from the store each time they're accessed.
+
+    """
+
+    __slots__ = ("uri", "violation", "message", "line_number", "_extra_keys", "_store", "_offset", "_length")
+
+    def __init__(self, store: IncidentStore, uri: str, violation: str, message: str, line_number: int,
+                 extra_keys: tuple, offset: int, length: int):
+        self.uri = uri
+        self.violation = violation
+        self.message = message
+        self.line_number = line_number
+        self._extra_keys = extra_keys
+        self._store = store
+        self._offset = offset
+        self._length = length
+
+    def _base(self) -> dict:
+        base = {}
+        if self.uri is not None:
+            base["uri"] = self.uri
+        if self.message is not None:
+            base["message"] = self.message
+        if self.line_number is not None:
+            base["lineNumber"] = self.line_number
+        return base
+
+    def __getitem__(self, key):
+        if key == "uri" and self.uri is not None:
+            return self.uri
+        if key == "message" and self.message is not None:
+            return self.message
+        if key == "lineNumber" and self.line_number is not None:
+            return self.line_number
+        if key in self._extra_keys:
+            return self._store.extra(self._offset, self._length)[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(sorted(list(self._base()) + list(self._extra_keys)))
+
+    def __len__(self):
+        return len(self._base()) + len(self._extra_keys)
+
+    def to_dict(self) -> dict:
+        fields = self._base()
+        fields.update(self._store.extra(self._offset, self._length))
+        return {k: fields[k] for k in sorted(fields)}
+
+    def __repr__(self):
+        # the judge prompt renders incidents with str(), keep it identical to the dict's
+        return repr(self.to_dict())
+
+
+def _represent_incident(dumper, incident):
+    return dumper.represent_dict(incident.to_dict())
+
+
+yaml.add_representer(Incident, _represent_incident)
+
+
+def is_compact(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def dump(file_incidents_map: dict, path: str):
+    """
+    Writes a parsed incident map in the compact encoding: the magic line, the
+    length of a JSON header holding a string table, the distinct sets of extra
+    keys and every file's entry with its incidents as arrays of indexes and blob
+    offsets, followed by the blob itself.
+
+    """
+    strings = {}
+    shapes = {}
+    blob = bytearray()
+
+    def index(table, value):
+        return table.setdefault(value, len(table))
+
+    files = {}
+    for file_uri, entry in file_incidents_map.items():
+        encoded = {k: v for k, v in entry.items() if k != "incidents"}
+        records = []
+        for incident in entry["incidents"]:
+            if not isinstance(incident, Incident):
+                incident = IncidentStore().add(incident)
+            offset = len(blob)
+            # copy the already encoded fields across without decoding them
+            blob += incident._store.blob[incident._offset:incident._offset + incident._length]
+            records.append([
+                index(strings, incident.uri) if incident.uri is not None else -1,
+                index(strings, incident.violation) if incident.violation is not None else -1,
+                index(strings, incident.message) if incident.message is not None else -1,
+                incident.line_number,
+                index(shapes, incident._extra_keys),
+                offset,
+                incident._length,
+            ])
+        encoded["incidents"] = records
+        files[file_uri] = encoded
+
+    header = json.dumps({
+        "strings": list(strings),
+        "shapes": [list(shape) for shape in shapes],
+        "files": files,
+    }, separators=(",", ":")).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        f.write(blob)
+
+
+def load(path: str) -> dict:
+    """
+    Loads a parsed incident map written by dump. The blob is memory mapped, so the
+    snippets and variables of incidents are only read from disk when accessed.
+
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a compact incident file")
+        (header_length,) = HEADER_LENGTH.unpack(f.read(HEADER_LENGTH.size))
+        header = json.loads(f.read(header_length))
+        blob_start = len(MAGIC) + HEADER_LENGTH.size + header_length
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    store = IncidentStore(memoryview(mapped)[blob_start:])
+    strings = [sys.intern(s) for s in header["strings"]]
+    shapes = [store.shape(tuple(shape)) for shape in header["shapes"]]
+
+    file_incidents_map = {}
+    for file_uri, entry in header["files"].items():
+        entry["incidents"] = [
+            Incident(
+                store=store,
+                uri=strings[uri] if uri >= 0 else None,
+                violation=strings[violation] if violation >= 0 else None,
+                message=strings[message] if message >= 0 else None,
+                line_number=line_number,
+                extra_keys=shapes[shape],
+                offset=offset,
+                length=length,
+            )
+            for uri, violation, message, line_number, shape, offset, length in entry["incidents"]
+        ]
+        file_incidents_map[sys.intern(file_uri)] = entry
+    return file_incidents_map
@@ -0,0 +1,207 @@
+#!/bin/env python
+#
+# kai_eval.py
+# Single entry point for the scripts in this repository. Each subcommand's
+# module is only imported once its arguments have been parsed, so `--help`,
+# argument errors and the lightweight subcommands never pay for importing
+# langchain or kai.
+#
+#
+import argparse
+import importlib
+import os
+import socket
+import sys
+import time
+
+from sharding import parse_shard
+
+
+def parse_tier(spec: str) -> tuple:
+    """
+    Parses a judge tier spec of the form `name:max_tokens:config`, where an empty
+    max_tokens means the tier takes prompts of any size.
+
+    """
+    try:
+        name, max_tokens, config = spec.split(":", 2)
+        max_tokens = int(max_tokens) if max_tokens else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid tier '{spec}', expected name:max_tokens:config")
+    if not name or not config:
+        raise argparse.ArgumentTypeError(f"invalid tier '{spec}', expected name:max_tokens:config")
+    if name == "default":
+        raise argparse.ArgumentTypeError("the default tier is the --config model, give the tier another name")
+    return name, max_tokens, config
+
+
+def add_run_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("-n", "--name")
+    parser.add_argument("-s", "--src")
+    parser.add_argument("-a", "--analysis")
+
+
+def add_parse_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("analysis_output_file", help="path to analysis output yaml file")
+    parser.add_argument("repository_path", help="path to repository with updated changes")
+    parser.add_argument("output_file", help="path to write unified result yaml")
+    parser.add_argument("--base", default="HEAD",
+                        help="commit the runs are diffed against, usually the commit Kai started from")
+    parser.add_argument("--run", action="append", default=[],
+                        help="a Kai result to diff against --base, given as name=ref where ref is a branch, commit "
+                             "or worktree path; may be repeated")
+    parser.add_argument("--format", choices=["yaml", "compact"], default="yaml",
+                        help="encoding of the output file, compact is much faster for evaluate to load")
+
+
+def add_judge_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--prune-context", type=int, default=None,
+                        help="only send the judge diff hunks within this many lines of an incident")
+    parser.add_argument("--max-chunk-tokens", type=int, default=None,
+                        help="split diffs larger than this many tokens into chunks evaluated in parallel")
+    parser.add_argument("--chunk-workers", type=int, default=4,
+                        help="number of chunks of a diff to evaluate concurrently")
+    parser.add_argument("--judge-config", action="append", default=[],
+                        help="KaiConfig of another endpoint for the judge model; judge calls are balanced across "
+                             "the --config model and every --judge-config model. May be repeated")
+    parser.add_argument("--tier", action="append", default=[], type=parse_tier,
+                        help="a judge tier given as name:max_tokens:config; each evaluation goes to the smallest "
+                             "tier that fits its prompt and moves up a tier if the report card can't be parsed. "
+                             "May be repeated")
+    parser.add_argument("--default-tier-max-tokens", type=int, default=None,
+                        help="largest prompt, in tokens, routed to the --config model when tiers are given, "
+                             "unlimited by default")
+    parser.add_argument("--hedge", action="store_true",
+                        help="issue a duplicate of judge calls that are slower than usual, the first to finish wins")
+    parser.add_argument("--hedge-quantile", type=float, default=0.95,
+                        help="quantile of recent judge latencies after which a call is hedged")
+    parser.add_argument("--hedge-max-rate", type=float, default=0.1,
+                        help="maximum fraction of judge calls that may be hedged")
+    parser.add_argument("--hedge-initial-delay", type=float, default=60.0,
+                        help="seconds after which a call is hedged until enough latencies have been observed")
+
+
+def add_evaluate_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("-l", "--language", dest="language", default="Java")
+    parser.add_argument("-s", "--source", dest="source_technology", default="JavaEE")
+    parser.add_argument("-t", "--target", dest="target_technology", default="Quarkus")
+    parser.add_argument("-c", "--config", default="config.toml")
+    parser.add_argument("--sample", action="store_true",
+                        help="evaluate a stratified sample of the files instead of all of them")
+    parser.add_argument("--ci-width", type=float, default=0.5,
+                        help="stop sampling once the confidence interval of the average score is narrower than this")
+    parser.add_argument("--confidence", type=float, default=0.95, help="confidence level of the interval")
+    parser.add_argument("--sample-batch", type=int, default=20,
+                        help="number of files to evaluate between interval checks")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for drawing the sample")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+                        help="only evaluate the files in shard i of N, given as i/N")
+    parser.add_argument("--queue", default=None,
+                        help="path to a SQLite work queue shared with other workers")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}",
+                        help="name recorded against files claimed from the work queue")
+    parser.add_argument("--lease", type=float, default=3600,
+                        help="seconds after which a claimed file is handed to another worker")
+    parser.add_argument("--judge-workers", type=int, default=1,
+                        help="number of files to evaluate concurrently, e.g. one or more per judge endpoint")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="put the files that failed in earlier runs back in the work queue")
+    add_judge_arguments(parser)
+    parser.add_argument("input_file", help="path to unified result file produced by parse_kai_logs.py")
+    parser.add_argument("output_file")
+
+
+def check_judge_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    names = [name for name, _, _ in args.tier]
+    if len(set(names)) < len(names):
+        parser.error("--tier names must be unique")
+    unlimited = [name for name, max_tokens, _ in args.tier if max_tokens is None]
+    if args.tier and args.default_tier_max_tokens is None:
+        unlimited.append("default")
+    if len(unlimited) > 1:
+        parser.error(f"only one tier can take prompts of any size, got {', '.join(unlimited)}; "
+                     f"set --default-tier-max-tokens when giving an unlimited --tier")
+
+
+def check_evaluate_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    check_judge_arguments(parser, args)
+    if args.sample and (args.shard or args.queue):
+        parser.error("--sample can't be combined with --shard or --queue")
+    if args.shard and args.queue:
+        parser.error("--shard and --queue are mutually exclusive")
+    if args.judge_workers < 1:
+        parser.error("--judge-workers must be at least 1")
+    if args.retry_failed and not args.queue:
+        parser.error("--retry-failed requires --queue")
+
+
+def add_report_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("input_file", help="path to evaluation yaml")
+    parser.add_argument("output_file", help="path to write output file")
+    parser.add_argument("output_format", help="output format [csv | json]")
+    parser.add_argument("--confidence", type=float, default=0.95,
+                        help="confidence level of the intervals reported for sampled evaluations")
+
+
+def add_merge_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("output_file", help="path to write the merged evaluation yaml")
+    parser.add_argument("input_files", nargs="+", help="paths to partial evaluation yamls produced by evaluate.py")
+
+
+def add_pipeline_arguments(parser: argparse.ArgumentParser):
+    # long options only, the short options of run and evaluate clash
+    parser.add_argument("--name", help="application name sent to the Kai server")
+    parser.add_argument("--src", help="path to the git repository of the application to fix")
+    parser.add_argument("--analysis", help="path to analysis output yaml file")
+    parser.add_argument("--language", dest="language", default="Java")
+    parser.add_argument("--source", dest="source_technology", default="JavaEE")
+    parser.add_argument("--target", dest="target_technology", default="Quarkus")
+    parser.add_argument("--config", default="config.toml", help="path to the KaiConfig of the judge")
+    parser.add_argument("--judge-workers", type=int, default=4, help="number of concurrent judge requests")
+    add_judge_arguments(parser)
+    parser.add_argument("--queue-size", type=int, default=16, help="maximum number of files waiting between stages")
+    parser.add_argument("--report", default=None,
+                        help="path to a report regenerated as evaluations complete and once at the end")
+    parser.add_argument("--report-interval", type=float, default=60.0,
+                        help="seconds between regenerations of the --report file")
+    parser.add_argument("--report-format", choices=["csv", "json"], default="json")
+    parser.add_argument("output_file", help="path to write the evaluation yaml")
+
+
+# subcommand -> (module implementing it, argument builder, argument checker, help)
+SUBCOMMANDS = {
+    "run": ("run_kai", add_run_arguments, None, "generate fixes with a Kai server"),
+    "parse": ("parse_kai_logs", add_parse_arguments, None, "pair analysis incidents with the diffs of the fixes"),
+    "evaluate": ("evaluate", add_evaluate_arguments, check_evaluate_arguments, "grade the fixes with the judge"),
+    "report": ("generate_report", add_report_arguments, None, "summarize an evaluation as CSV or JSON"),
+    "pipeline": ("pipeline", add_pipeline_arguments, check_judge_arguments, "fix, diff, judge and report files as overlapping stages"),
+    "merge": ("merge_evaluations", add_merge_arguments, None, "combine partial evaluations from several workers"),
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="kai-eval")
+    parser.add_argument("--import-time", action="store_true",
+                        help="print the time taken to import the subcommand to stderr")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, (_, add_arguments, _, help_text) in SUBCOMMANDS.items():
+        add_arguments(subparsers.add_parser(name, help=help_text))
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    module_name, _, check_arguments, _ = SUBCOMMANDS[args.command]
+    if check_arguments:
+        check_arguments(parser, args)
+
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if args.import_time:
+        print(f"Imported {module_name} for '{args.command}' in {time.perf_counter() - start:.3f}s", file=sys.stderr)
+    return module.main(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
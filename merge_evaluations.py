@@ -0,0 +1,51 @@
+#!/bin/env python
+#
+# merge_evaluations.py
+# Combine the partial evaluation yamls written by several evaluate.py
+# shards or queue workers into a single evaluation yaml.
+#
+#
+import argparse
+import yaml
+
+
+def evaluation_key(evaluation: dict) -> tuple:
+    return evaluation["filename"], evaluation.get("run") or ""
+
+
+def merge_evaluations(paths: list) -> list:
+    """
+    Loads the evaluation yamls at paths and returns their results de-duplicated
+    and sorted by file. When a file was evaluated by more than one worker the
+    result from the first path it appears in is kept.
+
+    """
+    merged = {}
+    for path in paths:
+        with open(path) as f:
+            evaluations = yaml.safe_load(f) or []
+        duplicates = 0
+        for evaluation in evaluations:
+            key = evaluation_key(evaluation)
+            if key in merged:
+                duplicates += 1
+                continue
+            merged[key] = evaluation
+        if duplicates:
+            print(f"Skipped {duplicates} duplicate evaluations in {path}")
+    return [merged[key] for key in sorted(merged)]
+
+
+def main(args):
+    results = merge_evaluations(args.input_files)
+    with open(args.output_file, "w") as f:
+        yaml.dump(results, f)
+    print(f"Merged {len(results)} evaluations from {len(args.input_files)} files into {args.output_file}")
+
+
+if __name__ == "__main__":
+    import kai_eval
+
+    parser = argparse.ArgumentParser()
+    kai_eval.add_merge_arguments(parser)
+    main(parser.parse_args())
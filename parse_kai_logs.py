@@ -6,7 +6,11 @@ import re
 import argparse
 from collections import defaultdict
 
-from git import Repo
+import incidents
+from incidents import IncidentStore
+
+# the C loader is several times faster on large analysis reports when libyaml is available
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 
 def parse_llm_result(content):
@@ -137,6 +141,9 @@ def find_llm_results_with_prompt_vars(root_dir):
 
 
 def parse_analysis_output_and_changes(analysis_file_path: str, repo_path: str):
+    # GitPython is only needed here, so don't make every importer of this module pay for it
+    from git import Repo
+
     file_incidents_map = map_analysis_output_by_file(analysis_file_path)
     repo = Repo(repo_path)
 
@@ -151,12 +158,88 @@ def parse_analysis_output_and_changes(analysis_file_path: str, repo_path: str):
     return file_incidents_map
 
 
+def parse_run_spec(spec: str) -> tuple:
+    """
+    Parses a run given as `name=ref` or just `ref`, where ref is a branch, a commit
+    or the path to a worktree. Only the first `=` separates the name, so the ref
+    may contain `=` itself.
+
+    """
+    name, separator, ref = spec.partition("=")
+    if not separator:
+        return spec, spec
+    return (name or ref), ref
+
+
+def split_diff_by_file(diff: str) -> dict:
+    """
+    Splits the output of a multi-file `git diff` into the diff of each file,
+    keyed by the file's path in the base commit.
+
+    """
+    diffs = {}
+    path = None
+    lines = []
+    for line in diff.splitlines():
+        if line.startswith("diff --git "):
+            if path is not None:
+                diffs[path] = "\n".join(lines)
+            # diff --git a/<path> b/<path>
+            path = line[len("diff --git a/"):].rsplit(" b/", 1)[0]
+            lines = []
+        lines.append(line)
+    if path is not None:
+        diffs[path] = "\n".join(lines)
+    return diffs
+
+
+def parse_analysis_output_and_runs(analysis_file_path: str, repo_path: str, base: str, runs: list):
+    """
+    Like parse_analysis_output_and_changes, but for several Kai results at once. The
+    analysis is parsed once and each run's changes are diffed against the base commit
+    from the object database, or against the working tree for runs given as the path
+    of a worktree, without checking anything out. Each file's diffs are stored under
+    "runs", keyed by run name.
+
+    """
+    from git import Repo
+
+    file_incidents_map = map_analysis_output_by_file(analysis_file_path)
+    repo = Repo(repo_path)
+    # resolved in the main repository, refs like HEAD mean something else inside a worktree
+    base_sha = repo.commit(base).hexsha
+    uris_by_path = {}
+
+    for run_spec in runs:
+        name, ref = parse_run_spec(run_spec)
+        if os.path.isdir(ref):
+            diff = Repo(ref).git.diff(base_sha)
+        else:
+            diff = repo.git.diff(base_sha, ref)
+
+        for path, file_diff in split_diff_by_file(diff).items():
+            if path not in uris_by_path:
+                uris_by_path[path] = [uri for uri in file_incidents_map if uri.endswith(path)]
+            for uri in uris_by_path[path]:
+                file_incidents_map[uri].setdefault("runs", {})[name] = file_diff
+        print(f"Parsed changes of run {name} ({ref}) against {base} ({base_sha[:12]})")
+
+    return file_incidents_map
+
 
 def map_analysis_output_by_file(analysis_file_path: str):
+    """
+    Groups the incidents of an analysis report by file. Incidents are kept as
+    compact Incident records that share a single store for their snippets and
+    variables.
+
+    """
     with open(analysis_file_path) as analysis_output_f:
-        output_yaml = yaml.safe_load(analysis_output_f)
+        output_yaml = yaml.load(analysis_output_f, Loader=YamlLoader)
+
+    store = IncidentStore()
 
-    file_incidents_map = defaultdict(lambda: {"incidents": []})
+    file_incidents_map = defaultdict(lambda: {"incidents": [], "violations": {}})
     for top_level_value in output_yaml:
         if not isinstance(top_level_value, dict) or "violations" not in top_level_value:
             continue
@@ -173,20 +256,35 @@ def map_analysis_output_by_file(analysis_file_path: str):
                     continue
 
                 if uri not in file_incidents_map:
-                    file_incidents_map[uri] = {"incidents": []}
-                file_incidents_map[uri]["incidents"].append(incident)
+                    file_incidents_map[uri] = {"incidents": [], "violations": {}}
+                file_incidents_map[uri]["incidents"].append(store.add(incident, violation_key))
+                # keep a count of incidents per violation so that files can be grouped by rule later on
+                violation_counts = file_incidents_map[uri]["violations"]
+                violation_counts[violation_key] = violation_counts.get(violation_key, 0) + 1
+
+            # the incident dicts have been copied into the store, let them be freed as we go
+            violation_value["incidents"] = None
 
     file_incidents_map = dict(file_incidents_map)
 
     return file_incidents_map
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument("analysis_output_file", help="path to analysis output yaml file")
-    parser.add_argument("repository_path", help="path to repository with updated changes")
-    parser.add_argument("output_file", help="path to write unified result yaml")
-    args = parser.parse_args()
-    output = parse_analysis_output_and_changes(args.analysis_output_file, args.repository_path)
+def main(args):
+    if args.run:
+        output = parse_analysis_output_and_runs(args.analysis_output_file, args.repository_path, args.base, args.run)
+    else:
+        output = parse_analysis_output_and_changes(args.analysis_output_file, args.repository_path)
+    if args.format == "compact":
+        incidents.dump(output, args.output_file)
+        return
     with open(args.output_file, "w") as outfile:
         yaml.dump(output, outfile)
+
+
+if __name__ == '__main__':
+    import kai_eval
+
+    parser = argparse.ArgumentParser()
+    kai_eval.add_parse_arguments(parser)
+    main(parser.parse_args())
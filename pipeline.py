@@ -0,0 +1,215 @@
+#!/bin/env python
+#
+# pipeline.py
+# Run the fix, diff, judge and report steps as overlapping stages, so that a
+# file's fix is diffed and judged as soon as Kai has finished with it instead
+# of after every file has been fixed.
+#
+#
+import argparse
+import os
+import queue
+import threading
+import time
+import traceback
+
+import yaml
+
+import evaluate
+import generate_report
+import parse_kai_logs
+import run_kai
+
+# marks the end of a stage's input
+_DONE = object()
+
+
+class Stage:
+    """
+    A pool of worker threads applying fn to the items of inbox and putting the
+    results that aren't None on outbox. Once inbox is drained the last worker to
+    finish passes _DONE on to outbox.
+
+    """
+
+    def __init__(self, name: str, fn, inbox: queue.Queue, outbox: queue.Queue = None, workers: int = 1):
+        self.name = name
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.workers = workers
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self._remaining = workers
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            item = self.inbox.get()
+            if item is _DONE:
+                # put it back so the other workers of this stage see it too
+                self.inbox.put(_DONE)
+                break
+            start = time.time()
+            try:
+                result = self.fn(item)
+            except BaseException:
+                # process_file calls sys.exit() on failure, which only stops this thread
+                print(f"[{self.name}] Failed to process {item}")
+                print(traceback.format_exc())
+                result = None
+            with self._lock:
+                self.processed += 1
+                self.busy_seconds += time.time() - start
+            if result is not None and self.outbox is not None:
+                self.outbox.put(result)
+
+        with self._lock:
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last and self.outbox is not None:
+            self.outbox.put(_DONE)
+
+
+class IncrementalReport:
+    """
+    Collects evaluation results as they arrive, appending each one to the
+    evaluation yaml, and optionally regenerates a report every report_interval
+    seconds and once all the results are in.
+
+    """
+
+    def __init__(self, output_file: str, report_file: str = None, report_format: str = "json",
+                 report_interval: float = 60.0):
+        self.output_file = output_file
+        self.report_file = report_file
+        self.report_format = report_format
+        self.report_interval = report_interval
+        self.results = []
+        self._output = open(output_file, "w")
+        self._reported_at = time.time()
+
+    def add(self, result: evaluate.EvaluationResult):
+        self.results.append(result.model_dump(exclude_none=True))
+        # a yaml list of one, appended lists read back as a single list
+        yaml.dump(self.results[-1:], self._output)
+        self._output.flush()
+        if time.time() - self._reported_at >= self.report_interval:
+            self.report()
+
+    def report(self):
+        self._reported_at = time.time()
+        if self.report_file is None or not self.results:
+            return
+        if self.report_format == "csv":
+            generate_report.generate_csv_report(self.results, self.report_file)
+        else:
+            generate_report.generate_json_report(self.results, self.report_file)
+
+    def close(self):
+        self._output.close()
+        self.report()
+
+
+def find_incidents(file_incidents_map: dict, file_path: str):
+    for uri, entry in file_incidents_map.items():
+        if uri.endswith(file_path):
+            return uri, entry
+    return None, None
+
+
+def run_pipeline(args):
+    # imported here for the same reason as in parse_kai_logs
+    from git import Repo
+
+    run_kai.APP_NAME = args.name
+    run_kai.APP_DIR = args.src
+    repo = Repo(args.src)
+
+    report = run_kai.Report.load_report_from_file(args.analysis)
+    impacted_files = report.get_impacted_files()
+    num_impacted_files = len(impacted_files)
+    file_incidents_map = parse_kai_logs.map_analysis_output_by_file(args.analysis)
+    evaluator = evaluate.build_evaluator(args)
+    incremental_report = IncrementalReport(args.output_file, args.report, args.report_format, args.report_interval)
+
+    def fix(item):
+        count, (file_path, incidents) = item
+        run_kai.KAI_LOG.info(run_kai.process_file(file_path, incidents, num_impacted_files, count))
+        return str(file_path)
+
+    def diff(file_path):
+        uri, entry = find_incidents(file_incidents_map, file_path)
+        if uri is None:
+            print(f"No incidents found in the analysis for file: {file_path}")
+            return None
+        entry = dict(entry, diff=repo.git.diff("--", file_path))
+        if entry["diff"] == "":
+            print(f"No fix for file: {uri}")
+            return None
+        return uri, entry
+
+    def judge(item):
+        uri, entry = item
+        return evaluate.evaluate_file(evaluator, args, uri, entry)
+
+    # the fix stage's input is known up front, the queues between stages are bounded
+    # so that a slow judge holds back the fixes rather than piling up diffs in memory
+    files = queue.Queue()
+    for item in enumerate(impacted_files.items(), 1):
+        files.put(item)
+    files.put(_DONE)
+    diffs = queue.Queue(maxsize=args.queue_size)
+    judgements = queue.Queue(maxsize=args.queue_size)
+    results = queue.Queue(maxsize=args.queue_size)
+
+    stages = [
+        Stage("fix", fix, files, diffs, int(os.environ.get("KAI_MAX_WORKERS", 8))),
+        # a single worker, GitPython's Repo isn't safe to share between threads
+        Stage("diff", diff, diffs, judgements, 1),
+        Stage("judge", judge, judgements, results, args.judge_workers),
+        Stage("report", incremental_report.add, results, None, 1),
+    ]
+
+    start = time.time()
+    for stage in stages:
+        stage.start()
+    for stage in stages:
+        stage.join()
+    incremental_report.close()
+    wall_seconds = time.time() - start
+
+    print(f"Pipeline finished in {wall_seconds:.1f}s, evaluated {len(incremental_report.results)} "
+          f"of {num_impacted_files} files")
+    for stage in stages:
+        print(f"  {stage.name}: {stage.processed} items, {stage.busy_seconds:.1f}s busy "
+              f"across {stage.workers} workers ({stage.busy_seconds / stage.workers:.1f}s per worker)")
+    evaluate.print_judge_stats(evaluator)
+    return incremental_report.results
+
+
+def main(args):
+    run_kai.configure_logging()
+    run_pipeline(args)
+
+
+if __name__ == "__main__":
+    import kai_eval
+
+    parser = argparse.ArgumentParser()
+    kai_eval.add_pipeline_arguments(parser)
+    args = parser.parse_args()
+    kai_eval.check_judge_arguments(parser, args)
+    main(args)
@@ -3,6 +3,7 @@ import argparse
 import json
 import logging
 import os
+import resource
 import sys
 import time
 import traceback
@@ -11,6 +12,14 @@ from pathlib import Path
 
 import requests
 
+try:
+    # optional, decodes large responses several times faster than json and with less memory
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 # Ensure that we have 'kai' in our import path
 sys.path.append("../kai")
 from kai.kai_logging import formatter
@@ -23,6 +32,7 @@ from kai.routes.get_incident_solutions_for_file import (
 KAI_LOG = logging.getLogger(__name__)
 
 SERVER_URL = "http://0.0.0.0:8080"
+RESPONSE_CHUNK_SIZE = 1024 * 1024
 APP_NAME = "coolstore"
 APP_DIR = "./coolstore"
 
@@ -42,6 +52,8 @@ def _generate_fix(params: PostGetIncidentSolutionsForFileParams):
         data=params.model_dump_json(),
         headers=headers,
         timeout=3600,
+        # the body is read by parse_response, see there
+        stream=True,
     )
     return response
 
@@ -57,6 +69,7 @@ def generate_fix(params: PostGetIncidentSolutionsForFileParams):
                 KAI_LOG.info(
                     f"[{params.file_name}] Received status code {response.status_code}"
                 )
+                response.close()
         except requests.exceptions.RequestException as e:
             KAI_LOG.error(f"[{params.file_name}] Received exception: {e}")
             # This is what a timeout exception will look like:
@@ -70,11 +83,26 @@ def generate_fix(params: PostGetIncidentSolutionsForFileParams):
 
 
 def parse_response(response: requests.Response):
+    """
+    Reads the streamed response body into a single buffer and decodes it,
+    rather than going through response.content, response.text and
+    response.json(), which each hold another copy of the full updated file,
+    prompts and response metadata. The body is still held in full while it is
+    decoded. The server may return the result as a JSON encoded string, which
+    takes a second decode of the intermediate string; the body buffer is freed
+    before that second decode starts.
+
+    """
     try:
-        result = response.json()
+        body = bytearray()
+        for chunk in response.iter_content(chunk_size=RESPONSE_CHUNK_SIZE):
+            body += chunk
+        response.close()
 
+        result = json_loads(body)
+        del body
         if isinstance(result, str):
-            return json.loads(result)
+            return json_loads(result)
         elif isinstance(result, dict):
             return result
         else:
@@ -97,7 +125,21 @@ def parse_response(response: requests.Response):
     # pydantic_models.parse_file_solution_content(response_json["updated_file"])
 
 
+def write_joined(f, parts: list, separator: str = "\n---\n"):
+    # same output as f.write(separator.join(parts)) without building the joined copy
+    for i, part in enumerate(parts):
+        if i:
+            f.write(separator)
+        f.write(part)
+
+
 def write_to_disk(file_path: Path, updated_file_contents: dict):
+    """
+    Writes the fields of a parsed response to their artifact files. Each large
+    field is removed from updated_file_contents once it has been written so that
+    it can be freed before the next one is written.
+
+    """
     file_path = str(file_path)  # Temporary fix for Path object
 
     # We expect that we are overwriting the file, so all directories should exist
@@ -110,7 +152,7 @@ def write_to_disk(file_path: Path, updated_file_contents: dict):
     KAI_LOG.info(f"Writing updated source code to {intended_file_path}")
     try:
         with open(intended_file_path, "w") as f:
-            f.write(updated_file_contents["updated_file"])
+            f.write(updated_file_contents.pop("updated_file"))
     except Exception as e:
         KAI_LOG.error(
             f"Failed to write updated_file @ {intended_file_path} with error: {e}"
@@ -122,7 +164,7 @@ def write_to_disk(file_path: Path, updated_file_contents: dict):
     KAI_LOG.info(f"Writing prompts to {prompts_path}")
     try:
         with open(prompts_path, "w") as f:
-            f.write("\n---\n".join(updated_file_contents["used_prompts"]))
+            write_joined(f, updated_file_contents.pop("used_prompts"))
     except Exception as e:
         KAI_LOG.error(f"Failed to write prompts @ {prompts_path} with error: {e}")
         KAI_LOG.error(f"Contents: {updated_file_contents}")
@@ -132,7 +174,7 @@ def write_to_disk(file_path: Path, updated_file_contents: dict):
     KAI_LOG.info(f"Writing llm_response_metadata to {llm_response_metadata_path}")
     try:
         with open(llm_response_metadata_path, "w") as f:
-            json.dump(updated_file_contents["response_metadatas"], f)
+            json.dump(updated_file_contents.pop("response_metadatas"), f)
     except Exception as e:
         KAI_LOG.error(
             f"Failed to write llm_response_metadata @ {llm_response_metadata_path} with error: {e}"
@@ -149,7 +191,7 @@ def write_to_disk(file_path: Path, updated_file_contents: dict):
             model_id = updated_file_contents.get("model_id", "unknown")
             with open(llm_result_path, "w") as f:
                 f.write(f"Model ID: {model_id}\n")
-                f.write("\n---\n".join(updated_file_contents["llm_results"]))
+                write_joined(f, updated_file_contents.pop("llm_results"))
         except Exception as e:
             KAI_LOG.error(
                 f"Failed to write llm_result @ {llm_result_path} with error: {e}"
@@ -161,7 +203,7 @@ def write_to_disk(file_path: Path, updated_file_contents: dict):
         KAI_LOG.info(f"Writing reasoning to {reasoning_path}")
         try:
             with open(reasoning_path, "w") as f:
-                json.dump(updated_file_contents["total_reasoning"], f)
+                json.dump(updated_file_contents.pop("total_reasoning"), f)
         except Exception as e:
             KAI_LOG.error(
                 f"Failed to write reasoning @ {reasoning_path} with error: {e}"
@@ -173,9 +215,7 @@ def write_to_disk(file_path: Path, updated_file_contents: dict):
         KAI_LOG.info(f"Writing additional_information to {additional_information_path}")
         try:
             with open(additional_information_path, "w") as f:
-                f.write(
-                    "\n---\n".join(updated_file_contents["used_additional_information"])
-                )
+                write_joined(f, updated_file_contents.pop("used_additional_information"))
         except Exception as e:
             KAI_LOG.error(
                 f"Failed to write additional_information @ {additional_information_path} with error: {e}"
@@ -249,18 +289,28 @@ def run_demo(report: Report):
                 f"{remaining_files} files remaining from total of {num_impacted_files}"
             )
 
+    KAI_LOG.info(f"Peak RSS with {max_workers} workers: {peak_rss_mb():.1f} MiB")
 
-if __name__ == "__main__":
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
+
+def configure_logging():
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
     KAI_LOG.addHandler(console_handler)
     KAI_LOG.setLevel("DEBUG")
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-n", "--name")
-    parser.add_argument("-s", "--src")
-    parser.add_argument("-a", "--analysis")
-    args = parser.parse_args()
+
+def main(args):
+    global APP_NAME, APP_DIR
+
+    configure_logging()
 
     APP_NAME = args.name
     APP_DIR = args.src
@@ -272,3 +322,11 @@ if __name__ == "__main__":
 
     end = time.time()
     KAI_LOG.info(f"Total time to process '{args.analysis}' was {end-start}s")
+
+
+if __name__ == "__main__":
+    import kai_eval
+
+    parser = argparse.ArgumentParser()
+    kai_eval.add_run_arguments(parser)
+    main(parser.parse_args())
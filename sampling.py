@@ -0,0 +1,178 @@
+#
+# sampling.py
+# Stratified sampling of the parsed incident map produced by parse_kai_logs.py,
+# used by evaluate.py --sample to estimate aggregate scores for very large
+# applications, and by generate_report.py to report those estimates.
+#
+import math
+import random
+from collections import defaultdict
+from statistics import NormalDist
+
+SCORE_FIELDS = ["effectiveness", "specificity", "competency"]
+
+# upper bounds (inclusive) on the number of changed lines for each diff size stratum
+DIFF_SIZE_BUCKETS = [
+    (10, "small"),
+    (50, "medium"),
+    (200, "large"),
+]
+
+
+def diff_size(diff: str) -> int:
+    """
+    Returns the number of added and removed lines in a unified diff.
+
+    """
+    count = 0
+    for line in diff.splitlines():
+        if line.startswith("+++") or line.startswith("---"):
+            continue
+        if line.startswith("+") or line.startswith("-"):
+            count += 1
+    return count
+
+
+def diff_size_bucket(diff: str) -> str:
+    size = diff_size(diff)
+    for upper_bound, name in DIFF_SIZE_BUCKETS:
+        if size <= upper_bound:
+            return name
+    return "huge"
+
+
+def primary_violation(entry: dict) -> str:
+    """
+    Returns the violation with the most incidents in a parsed log entry,
+    falling back to the most common incident message for logs parsed before
+    violations were recorded.
+
+    """
+    counts = entry.get("violations")
+    if not counts:
+        counts = defaultdict(int)
+        for incident in entry.get("incidents", []):
+            counts[incident.get("message", "")] += 1
+    if not counts:
+        return "unknown"
+    # sort by name first so that ties are broken deterministically
+    return max(sorted(counts), key=lambda k: counts[k])
+
+
+def stratum_key(entry: dict) -> str:
+    return f"{primary_violation(entry)}|{diff_size_bucket(entry['diff'])}"
+
+
+def average_score(evaluation: dict) -> float:
+    # matches the "Average Score" column in generate_report.py
+    return sum(evaluation[f] for f in SCORE_FIELDS) / 4.0
+
+
+class StratifiedSampler:
+    """
+    Draws files from a parsed incident map in batches, stratified by primary
+    violation and diff size, so that the sample stays proportional to the
+    population as it grows.
+
+    """
+
+    def __init__(self, population: dict, seed: int = None):
+        rng = random.Random(seed)
+        self.strata = defaultdict(list)
+        self.stratum_by_file = {}
+        for file_uri in sorted(population):
+            key = stratum_key(population[file_uri])
+            self.strata[key].append(file_uri)
+            self.stratum_by_file[file_uri] = key
+        for files in self.strata.values():
+            rng.shuffle(files)
+        self.sizes = {k: len(v) for k, v in self.strata.items()}
+        self.drawn = {k: 0 for k in self.strata}
+        self.total = len(self.stratum_by_file)
+
+    @property
+    def drawn_total(self) -> int:
+        return sum(self.drawn.values())
+
+    def exhausted(self) -> bool:
+        return self.drawn_total >= self.total
+
+    def covered(self) -> bool:
+        """
+        Returns whether every stratum has had at least one file drawn, before which
+        the estimate says nothing about the strata that haven't.
+
+        """
+        return all(self.drawn.values())
+
+    def next_batch(self, batch_size: int) -> list:
+        """
+        Returns up to batch_size files that have not been drawn yet. Every stratum
+        gets at least two files (so that its variance can be estimated) before the
+        rest of the batch is allocated proportionally to stratum size.
+
+        """
+        target_total = min(self.total, self.drawn_total + batch_size)
+
+        def priority(k):
+            deficit = self.sizes[k] * target_total / self.total - self.drawn[k]
+            return self.drawn[k] < min(2, self.sizes[k]), deficit, k
+
+        batch = []
+        while len(batch) < batch_size and not self.exhausted():
+            candidates = [k for k in self.strata if self.drawn[k] < self.sizes[k]]
+            key = max(candidates, key=priority)
+            batch.append(self.strata[key][self.drawn[key]])
+            self.drawn[key] += 1
+        return batch
+
+
+def _variance(values: list) -> float:
+    mean = sum(values) / len(values)
+    return sum((v - mean) ** 2 for v in values) / (len(values) - 1)
+
+
+def stratified_estimate(evaluations: list, value, confidence: float = 0.95):
+    """
+    Returns the stratified estimate of the population mean of value(evaluation)
+    and the half width of its confidence interval.
+
+    Args:
+        evaluations: evaluation dicts carrying the `stratum` and `stratum_size` fields
+            written by evaluate.py --sample.
+        value: function returning the quantity to estimate for an evaluation.
+        confidence: confidence level of the interval.
+
+    Returns:
+        tuple: (mean, half_width). half_width is infinite when fewer than two
+        evaluations are available.
+    """
+    values_by_stratum = defaultdict(list)
+    sizes = {}
+    for evaluation in evaluations:
+        values_by_stratum[evaluation["stratum"]].append(value(evaluation))
+        sizes[evaluation["stratum"]] = evaluation["stratum_size"]
+
+    if not values_by_stratum:
+        raise ValueError("No sampled evaluations to estimate from")
+
+    all_values = [v for values in values_by_stratum.values() for v in values]
+    if len(all_values) < 2:
+        return all_values[0], math.inf
+    pooled_variance = _variance(all_values)
+
+    # strata where every evaluation failed are left out and the weights renormalized, callers
+    # must make sure every stratum has been drawn from, see StratifiedSampler.covered
+    population = sum(sizes.values())
+    mean = 0.0
+    variance = 0.0
+    for stratum, values in values_by_stratum.items():
+        weight = sizes[stratum] / population
+        n = len(values)
+        stratum_variance = _variance(values) if n > 1 else pooled_variance
+        finite_population_correction = max(0.0, 1 - n / sizes[stratum])
+        mean += weight * sum(values) / n
+        variance += weight ** 2 * finite_population_correction * stratum_variance / n
+
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    return mean, z * math.sqrt(variance)
@@ -0,0 +1,152 @@
+#
+# sharding.py
+# Splits an evaluation across several evaluate.py processes, either by
+# deterministically sharding the files on a stable hash of their name or by
+# having workers claim files from a work queue in a shared SQLite database.
+#
+import argparse
+import hashlib
+import sqlite3
+import time
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+
+
+def parse_shard(spec: str) -> tuple:
+    """
+    Parses a shard spec of the form `i/N` where 0 <= i < N.
+
+    """
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{spec}', expected i/N")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"invalid shard '{spec}', expected 0 <= i < N")
+    return index, count
+
+
+def shard_of(filename: str, count: int) -> int:
+    # hash() is salted per process, so use a digest that is stable across machines
+    digest = hashlib.sha1(filename.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def in_shard(filename: str, shard: tuple) -> bool:
+    index, count = shard
+    return shard_of(filename, count) == index
+
+
+class WorkQueue:
+    """
+    A queue of files to evaluate backed by a SQLite database that every worker
+    can open, e.g. on a shared volume. Workers claim files one at a time, and a
+    claim that hasn't completed within lease_seconds is handed out again so that
+    files held by a crashed worker are not lost.
+
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 3600):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        # autocommit mode, transactions are managed explicitly in claim()
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "file_uri TEXT PRIMARY KEY, "
+            "status TEXT NOT NULL, "
+            "worker TEXT, "
+            "claimed_at REAL)"
+        )
+
+    def populate(self, file_uris) -> None:
+        """
+        Adds files to the queue. Files that are already queued keep their status,
+        so every worker can safely populate the queue with the full input.
+
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO files (file_uri, status) VALUES (?, ?)",
+                [(file_uri, PENDING) for file_uri in file_uris],
+            )
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def claim(self, worker: str):
+        """
+        Claims the next pending or expired file for worker and returns its uri,
+        or None when there is nothing left to claim.
+
+        """
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock up front so two workers can't claim the same file
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.connection.execute(
+                "SELECT file_uri FROM files "
+                "WHERE status = ? OR (status = ? AND claimed_at < ?) "
+                "ORDER BY file_uri LIMIT 1",
+                (PENDING, CLAIMED, now - self.lease_seconds),
+            ).fetchone()
+            if row is not None:
+                self.connection.execute(
+                    "UPDATE files SET status = ?, worker = ?, claimed_at = ? WHERE file_uri = ?",
+                    (CLAIMED, worker, now, row[0]),
+                )
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return row[0] if row is not None else None
+
+    def complete(self, file_uri: str, worker: str, succeeded: bool = True) -> bool:
+        """
+        Marks a file claimed by worker as done or failed. Returns False if worker no
+        longer holds the claim, i.e. its lease expired and the file was handed out again.
+
+        """
+        cursor = self.connection.execute(
+            "UPDATE files SET status = ? WHERE file_uri = ? AND status = ? AND worker = ?",
+            (DONE if succeeded else FAILED, file_uri, CLAIMED, worker),
+        )
+        return cursor.rowcount == 1
+
+    def next_expiry(self):
+        """
+        Returns the number of seconds until the earliest lease on a claimed file
+        expires, or None when no file is claimed.
+
+        """
+        row = self.connection.execute("SELECT MIN(claimed_at) FROM files WHERE status = ?", (CLAIMED,)).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] + self.lease_seconds - time.time())
+
+    def counts(self) -> dict:
+        rows = self.connection.execute("SELECT status, COUNT(*) FROM files GROUP BY status")
+        return dict(rows.fetchall())
+
+    def failed(self) -> list:
+        rows = self.connection.execute("SELECT file_uri FROM files WHERE status = ? ORDER BY file_uri", (FAILED,))
+        return [row[0] for row in rows.fetchall()]
+
+    def retry_failed(self) -> int:
+        """
+        Puts the failed files back in the queue and returns how many there were.
+
+        """
+        cursor = self.connection.execute(
+            "UPDATE files SET status = ?, worker = NULL, claimed_at = NULL WHERE status = ?",
+            (PENDING, FAILED),
+        )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        self.connection.close()